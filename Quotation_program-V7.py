@@ -1,13 +1,21 @@
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+from tkinter import ttk, filedialog, messagebox, simpledialog
 import pandas as pd
+import numpy as np
+import polars as pl
 import json
 import os
+import re
+import bisect
 from datetime import datetime
 import sys
+import time
+import queue
+import threading
 from pathlib import Path
 from openpyxl import load_workbook
 from openpyxl.styles import Font, Alignment, Border, Side, PatternFill, NumberFormatDescriptor
+from pypinyin import lazy_pinyin, Style
 
 class QuotationApp:
     def __init__(self, root):
@@ -40,15 +48,56 @@ class QuotationApp:
         # 存储完整的产品数据
         self.full_product_data = []
 
+        # 拼音搜索：各产品行的拼音检索键拼接为一个检索文本，首次拼音搜索时建立，新数据到达后增量补上
+        # 每个产品库只保留一个字符串和一个行起始位置数组，多个产品库同时保留也不占用太多内存
+        self.pinyin_index = None  # (检索文本, 各产品行在检索文本中的起始位置)，None 表示尚未建立
+        self.pinyin_cache = {}  # 中文片段 -> (全拼, 首字母)，避免重复转换
+        self.PINYIN_TOP_K = 200  # 拼音搜索最多显示的结果数
+
+        # 后台导入：解析线程把数据分块放入队列，界面线程通过 root.after 逐块取出
+        self.IMPORT_CHUNK_SIZE = 1000  # 每块行数
+        self.IMPORT_VALIDATE_SIZE = 5000  # 每批检查的行数，整批检查以减少 pandas 的固定开销
+        self.MAX_SPEC_LENGTH = 255  # 规格型号最大长度，超出的行视为错误
+        self.import_queue = None  # 当前导入的数据队列，None 表示没有正在进行的导入
+        self.import_cancel_event = None  # 取消导入的信号
+        self.import_backup = None  # 导入前的产品数据，取消或失败时恢复
+
+        # 多个产品库（供应商价格表）同时保留，当前显示的产品库即 full_product_data 等字段
+        self.catalogs = {}  # 产品库名称 -> 产品数据、拼音索引和价格表
+        self.active_catalog = None  # 当前显示的产品库名称
+        self.cheapest_frame = None  # 各物料编码在所有产品库中的最低价，产品库变化时清空重算
+
+        # 毛利率测算：一次最多测算的毛利率个数，超出时提示调整步长
+        self.MAX_MARGIN_STEPS = 1000
+
         # 历史记录文件路径
         self.history_file = self.get_history_file_path()
 
+        # 历史报价单全文检索的倒排索引（词 -> 记录ID集合），保存和删除时增量维护
+        # 记录ID在加载和保存时依次分配，时间戳只精确到秒，同一秒保存的报价单也能区分
+        self.history_index = {}
+        self.history_tokens = {}  # 记录ID -> 该报价单的词集合，用于删除时撤销索引
+        self.history_meta = {}  # 记录ID -> (时间, 总金额数值, 总金额, 毛利率)
+        self.history_vocab = []  # 有序词表，用于前缀匹配
+        self.history_ids = []  # 与历史记录文件中的条目一一对应的记录ID
+        self.history_next_id = 0  # 下一个记录ID，也用作历史记录表格的行ID
+
+        # 自动保存日志：报价单的每次修改追加一条记录，记录数达到上限时写入快照并截断日志
+        self.journal_file = str(Path(self.history_file).with_name("quotation_journal.jsonl"))
+        self.journal_handle = None  # 追加模式打开的日志文件
+        self.journal_count = 0  # 上次快照之后的记录数
+        self.journal_margin = ""  # 最近一次记录的毛利率，避免重复记录
+        self.JOURNAL_CHECKPOINT_INTERVAL = 500  # 每多少条记录写一次快照
+
         # 初始化界面元素
         self.create_widgets()
 
         # 加载历史记录
         self.load_history_from_file()
 
+        # 恢复上次未保存的报价单
+        self.restore_from_journal()
+
     def on_minimize(self, event):
         """窗口最小化事件处理"""
         pass  # 这里可以添加窗口最小化时的处理逻辑，目前为空
@@ -109,9 +158,23 @@ class QuotationApp:
         btn_export = tk.Button(toolbar, text="导出报价单", command=self.export_excel)
         btn_export.pack(side=tk.RIGHT, padx=5)
 
+        # 批量重新定价按钮
+        btn_reprice = tk.Button(toolbar, text="批量重新定价", command=self.reprice_history)
+        btn_reprice.pack(side=tk.RIGHT, padx=5)
+
         # 导入按钮 - 确保 command 参数正确指向 self.import_excel
-        btn_import = tk.Button(toolbar, text="导入Excel", command=self.import_excel) # 确保这里是 self.import_excel
-        btn_import.pack(side=tk.LEFT, padx=5)
+        self.btn_import = tk.Button(toolbar, text="导入Excel", command=self.import_excel) # 确保这里是 self.import_excel
+        self.btn_import.pack(side=tk.LEFT, padx=5)
+
+        # 产品库选择、移除和多产品库比价
+        self.catalog_var = tk.StringVar()
+        self.catalog_combo = ttk.Combobox(toolbar, textvariable=self.catalog_var, state="readonly", width=15, font=self.font_style)
+        self.catalog_combo.pack(side=tk.LEFT, padx=5)
+        self.catalog_combo.bind("<<ComboboxSelected>>", self.select_catalog)
+        btn_remove_catalog = tk.Button(toolbar, text="移除", command=self.remove_catalog)
+        btn_remove_catalog.pack(side=tk.LEFT)
+        btn_compare = tk.Button(toolbar, text="多库比价", command=self.open_catalog_comparison)
+        btn_compare.pack(side=tk.LEFT, padx=5)
 
         # 搜索框
         self.search_var = tk.StringVar()
@@ -119,6 +182,20 @@ class QuotationApp:
         self.search_entry.pack(side=tk.LEFT, padx=10)
         self.search_entry.bind("<KeyRelease>", self.filter_products)
 
+        # 拼音搜索模式开关
+        self.pinyin_mode_var = tk.BooleanVar(value=False)
+        pinyin_check = tk.Checkbutton(toolbar, text="拼音搜索", variable=self.pinyin_mode_var, command=self.filter_products)
+        pinyin_check.pack(side=tk.LEFT)
+
+        # 导入进度：进度条、解析速度和取消按钮，仅在导入时显示
+        self.import_progress_frame = tk.Frame(toolbar)
+        self.import_progress = ttk.Progressbar(self.import_progress_frame, length=150, mode="determinate")
+        self.import_progress.pack(side=tk.LEFT, padx=5)
+        self.import_status_label = tk.Label(self.import_progress_frame, text="", font=self.font_style)
+        self.import_status_label.pack(side=tk.LEFT, padx=5)
+        btn_cancel_import = tk.Button(self.import_progress_frame, text="取消导入", command=self.cancel_import)
+        btn_cancel_import.pack(side=tk.LEFT, padx=5)
+
         # 产品表格框架
         self.product_frame = tk.LabelFrame(main_frame, text="产品列表", font=self.bold_font)
         self.product_frame.pack(fill=tk.BOTH, expand=True, pady=5)
@@ -150,7 +227,11 @@ class QuotationApp:
         tk.Label(row1_frame, text="毛利率（%）：", font=self.font_style).pack(side=tk.LEFT, padx=(40, 0))
         self.profit_margin_entry = ttk.Entry(row1_frame, width=10, font=self.font_style)
         self.profit_margin_entry.pack(side=tk.LEFT, padx=5)
-        self.profit_margin_entry.bind("<KeyRelease>", self.calculate_total) # 绑定键盘释放事件，实时计算总价
+        self.profit_margin_entry.bind("<KeyRelease>", self.on_profit_margin_change) # 绑定键盘释放事件，实时计算总价
+
+        # 毛利率测算按钮
+        btn_margin_sweep = tk.Button(row1_frame, text="毛利率测算", font=self.font_style, command=self.open_margin_sweep)
+        btn_margin_sweep.pack(side=tk.LEFT, padx=5)
 
         # 第二行：最终含税总价框架
         row2_frame = tk.Frame(bottom_frame)
@@ -168,6 +249,10 @@ class QuotationApp:
         btn_clear = tk.Button(row2_frame, text="清空配置", font=self.font_style, command=self.clear_quotation)
         btn_clear.pack(side=tk.LEFT, padx=(30, 0))
 
+        # 新建分组按钮：将选中行归入柜体/子组件分组
+        btn_group = tk.Button(row2_frame, text="新建分组", font=self.font_style, command=self.create_quotation_group)
+        btn_group.pack(side=tk.LEFT, padx=(10, 0))
+
         # 主内容区域框架
         content_frame = tk.Frame(main_frame, height=200) # 设置高度
         content_frame.pack(fill=tk.BOTH, expand=True)
@@ -188,6 +273,35 @@ class QuotationApp:
         history_frame = tk.LabelFrame(content_frame, text="历史报价记录", font=self.bold_font, height=50) # 设置高度
         history_frame.pack(side=tk.RIGHT, fill=tk.BOTH, padx=10, pady=10, ipadx=10, ipady=5)
 
+        # 历史记录搜索框架：关键词 + 日期范围 + 金额范围
+        history_search_frame = tk.Frame(history_frame)
+        history_search_frame.pack(fill=tk.X, padx=5, pady=(5, 0))
+
+        tk.Label(history_search_frame, text="关键词：", font=self.font_style).grid(row=0, column=0, sticky="e")
+        self.history_search_var = tk.StringVar()
+        history_search_entry = ttk.Entry(history_search_frame, textvariable=self.history_search_var, width=20, font=self.font_style)
+        history_search_entry.grid(row=0, column=1, columnspan=3, sticky="we", pady=2)
+        history_search_entry.bind("<KeyRelease>", self.search_history) # 输入时实时检索
+
+        tk.Label(history_search_frame, text="日期：", font=self.font_style).grid(row=1, column=0, sticky="e")
+        self.history_date_from = ttk.Entry(history_search_frame, width=11, font=self.font_style) # 起始日期 YYYY-MM-DD
+        self.history_date_from.grid(row=1, column=1, pady=2)
+        tk.Label(history_search_frame, text="至", font=self.font_style).grid(row=1, column=2)
+        self.history_date_to = ttk.Entry(history_search_frame, width=11, font=self.font_style) # 结束日期 YYYY-MM-DD
+        self.history_date_to.grid(row=1, column=3, pady=2)
+
+        tk.Label(history_search_frame, text="金额：", font=self.font_style).grid(row=2, column=0, sticky="e")
+        self.history_amount_min = ttk.Entry(history_search_frame, width=11, font=self.font_style) # 最低金额
+        self.history_amount_min.grid(row=2, column=1, pady=2)
+        tk.Label(history_search_frame, text="至", font=self.font_style).grid(row=2, column=2)
+        self.history_amount_max = ttk.Entry(history_search_frame, width=11, font=self.font_style) # 最高金额
+        self.history_amount_max.grid(row=2, column=3, pady=2)
+
+        btn_history_search = tk.Button(history_search_frame, text="搜索", font=self.font_style, command=self.search_history)
+        btn_history_search.grid(row=1, column=4, padx=5)
+        btn_history_reset = tk.Button(history_search_frame, text="重置", font=self.font_style, command=self.reset_history_search)
+        btn_history_reset.grid(row=2, column=4, padx=5)
+
         # 历史记录表格
         self.history_tree = ttk.Treeview(history_frame, columns=("时间", "总金额", "毛利率", "操作"), show="headings")
         self.history_tree.heading("时间", text="时间")
@@ -259,7 +373,12 @@ class QuotationApp:
     def create_quotation_table(self):
         """创建报价单表格"""
         columns = ("物料编码", "物料名称", "规格型号", "数量", "含税单价", "小计", "操作") # 定义报价单表格列名
-        self.quotation_tree = ttk.Treeview(self.quotation_frame, columns=columns, show="headings") # 创建报价单表格
+        self.quotation_tree = ttk.Treeview(self.quotation_frame, columns=columns, show="tree headings") # 创建报价单表格，树形列显示分组
+
+        # 分组列：分组行（柜体、子组件）作为父节点，其下为明细行或子分组
+        self.quotation_tree.heading("#0", text="分组")
+        self.quotation_tree.column("#0", width=140)
+        self.quotation_tree.tag_configure("group", font=self.bold_font) # 分组行加粗
 
         # 设置列宽
         col_widths = [120, 150, 350, 80, 80, 80, 60]
@@ -301,7 +420,7 @@ class QuotationApp:
 
         # 只处理操作列（第7列）
         if column == "#7": # 操作列索引为 #7
-            self.quotation_tree.delete(item) # 删除选中行
+            self.delete_quotation_items([item]) # 删除选中行（分组连同其下所有行）
             self.calculate_total()  # 重新计算总价
 
     def edit_quotation_item(self, event):
@@ -313,8 +432,8 @@ class QuotationApp:
         column = self.quotation_tree.identify_column(event.x) # 识别点击列
         item = self.quotation_tree.identify_row(event.y) # 识别点击行
 
-        # 只允许编辑“数量”和“含税单价”列
-        if column not in ("#4", "#5"): # 数量列索引为 #4，含税单价列索引为 #5
+        # 只允许编辑明细行的“数量”和“含税单价”列
+        if column not in ("#4", "#5") or self.is_quotation_group(item): # 数量列索引为 #4，含税单价列索引为 #5
             return
 
         # 获取当前单元格的值
@@ -346,6 +465,7 @@ class QuotationApp:
 
             # 更新报价单表格中的值
             values = list(self.quotation_tree.item(item, "values")) # 获取行数据并转换为列表
+            old_subtotal = float(values[5]) # 原小计，用于增量更新上级分组小计
             values[col_index] = new_value # 更新指定列的值
 
             # 如果是数量或含税单价列，重新计算小计
@@ -369,6 +489,9 @@ class QuotationApp:
 
             # 更新行数据
             self.quotation_tree.item(item, values=values) # 更新表格行数据
+            parent = self.quotation_tree.parent(item)
+            self.adjust_group_subtotals(parent, float(values[5]) - old_subtotal) # 只更新该行的各级上级分组
+            self.journal_record({"op": "set", "id": item, "parent": parent, "values": values}) # 记录到自动保存日志
 
             # 销毁编辑框
             self.quotation_edit_entry.destroy() # 销毁编辑框
@@ -384,11 +507,22 @@ class QuotationApp:
             return
 
         # 获取选中行的数据
-        values = self.quotation_tree.item(selected_item, "values") # 获取行数据
+        values = self.quotation_tree.item(selected_item[0], "values") # 获取行数据
 
         # 清空原有内容
         self.selected_item_info.delete(1.0, tk.END) # 清空文本框
 
+        # 分组行显示分组名称、明细行数和小计
+        if self.is_quotation_group(selected_item[0]):
+            line_count = sum(1 for _ in self.iter_quotation_lines(selected_item[0]))
+            info = (
+                f"分组: {self.quotation_tree.item(selected_item[0], 'text')}\n"
+                f"明细行数: {line_count}\n"
+                f"小计: {values[5]}\n"
+            )
+            self.selected_item_info.insert(tk.END, info)
+            return
+
         # 显示详细信息
         info = (
             f"物料编码: {values[0]}\n"
@@ -402,18 +536,8 @@ class QuotationApp:
 
     def save_quotation(self):
         """保存当前报价单到历史记录"""
-        # 获取当前报价单数据
-        quotation_data = []
-        for item in self.quotation_tree.get_children(): # 遍历报价单表格的所有行
-            values = self.quotation_tree.item(item, "values") # 获取每行的数据
-            quotation_data.append({ # 将每行数据以字典形式添加到列表
-                "物料编码": values[0],
-                "物料名称": values[1],
-                "规格型号": values[2],
-                "数量": values[3],
-                "含税单价": values[4],
-                "小计": values[5]
-            })
+        # 获取当前报价单数据和分组结构
+        quotation_data, quotation_groups = self.collect_history_detail()
 
         # 获取当前时间和毛利率
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S") # 获取当前时间
@@ -425,20 +549,55 @@ class QuotationApp:
         # 获取总金额
         total_amount = self.total_label.get().replace(",", "") # 获取总金额，并移除千分位分隔符
 
-        # 添加到历史记录表格
-        self.history_tree.insert("", "end", values=(current_time, total_amount, f"{profit_margin:.2f}%", "删除")) # 添加历史记录到表格
-
         # 保存到文件
-        self.save_history_to_file(current_time, total_amount, profit_margin, quotation_data) # 调用函数保存到文件
+        self.save_history_to_file(current_time, total_amount, profit_margin, quotation_data, quotation_groups) # 调用函数保存到文件
+
+        # 按当前检索条件刷新历史记录表格，新记录不符合条件时不显示
+        self.search_history()
 
-    def save_history_to_file(self, current_time, total_amount, profit_margin, quotation_data):
+    def collect_history_detail(self):
+        """按报价单顺序收集明细行和分组结构，返回 (明细行列表, 分组列表)
+
+        分组按深度优先顺序编号（顶层为0），同名分组、空分组也各自保留；
+        分组的“位置”为排在它前面的明细行数，加载时据此恢复分组与明细行的先后顺序。
+        """
+        quotation_data = []
+        quotation_groups = []
+
+        def collect(parent, group_id):
+            for item in self.quotation_tree.get_children(parent):
+                if self.is_quotation_group(item):
+                    quotation_groups.append({
+                        "编号": len(quotation_groups) + 1,
+                        "名称": self.quotation_tree.item(item, "text"),
+                        "上级": group_id,
+                        "位置": len(quotation_data)
+                    })
+                    collect(item, len(quotation_groups))
+                else:
+                    values = self.quotation_tree.item(item, "values") # 获取每行的数据
+                    quotation_data.append({ # 将每行数据以字典形式添加到列表
+                        "物料编码": values[0],
+                        "物料名称": values[1],
+                        "规格型号": values[2],
+                        "数量": values[3],
+                        "含税单价": values[4],
+                        "小计": values[5],
+                        "分组编号": group_id # 所在分组，对应“分组结构”中的编号
+                    })
+
+        collect("", 0)
+        return quotation_data, quotation_groups
+
+    def save_history_to_file(self, current_time, total_amount, profit_margin, quotation_data, quotation_groups=()):
         """将历史记录保存到JSON文件"""
         history_entry = {
             "时间": current_time,
             "总金额": total_amount,
             "毛利率": f"{profit_margin:.2f}%",
-            "报价单详情": quotation_data  # 添加报价单详细数据
-        } # 创建历史记录条目，包含时间、总金额、毛利率和报价单详情
+            "报价单详情": quotation_data,  # 添加报价单详细数据
+            "分组结构": list(quotation_groups) # 添加分组结构
+        } # 创建历史记录条目，包含时间、总金额、毛利率、报价单详情和分组结构
 
         # 读取现有历史记录
         try:
@@ -454,6 +613,9 @@ class QuotationApp:
         with open(self.history_file, "w", encoding="utf-8") as file: # 以写入模式打开历史记录文件
             json.dump(history, file, ensure_ascii=False, indent=4) # 将更新后的历史记录写入JSON文件，并格式化
 
+        # 增量更新检索索引
+        self.index_history_entry(history_entry)
+
     def load_history_from_file(self):
         """从JSON文件加载历史记录并在历史记录表格中显示"""
         if not os.path.exists(self.history_file): # 如果历史记录文件不存在，则直接返回
@@ -463,7 +625,128 @@ class QuotationApp:
             history_data = json.load(f) # 从JSON文件加载历史记录数据
 
         for entry in history_data: # 遍历历史记录数据
-            self.history_tree.insert("", "end", values=(entry["时间"], entry["总金额"], entry["毛利率"], "删除")) # 将每条历史记录添加到历史记录表格
+            record_id = self.index_history_entry(entry, keep_sorted=False) # 建立检索索引，新词先追加到词表
+            self.history_tree.insert("", "end", iid=str(record_id), values=(entry["时间"], entry["总金额"], entry["毛利率"], "删除")) # 将每条历史记录添加到历史记录表格
+        self.history_vocab.sort() # 全部加载后一次性排序词表
+
+    def tokenize_search_text(self, text):
+        """将文本切分为检索词：英文数字按连续片段切分，中文按单字和相邻双字切分"""
+        text = str(text).lower()
+        tokens = set(re.findall(r"[0-9a-z]+", text)) # 型号、编码中的字母数字片段
+        for run in re.findall(r"[\u4e00-\u9fff]+", text): # 连续的中文片段
+            tokens.update(run) # 单字
+            tokens.update(run[i:i + 2] for i in range(len(run) - 1)) # 相邻双字
+        return tokens
+
+    def index_history_entry(self, entry, keep_sorted=True):
+        """将一条追加到历史记录文件末尾的报价单的物料编码、物料名称、规格型号加入倒排索引，返回其记录ID
+
+        keep_sorted 为 False 时新词只追加到词表末尾，由批量加载的调用方在最后统一排序。
+        """
+        record_id = self.history_next_id
+        self.history_next_id += 1
+        self.history_ids.append(record_id)
+
+        tokens = set()
+        for item_data in entry.get("报价单详情", []): # 遍历报价单的每一行
+            for key in ("物料编码", "物料名称", "规格型号"):
+                tokens |= self.tokenize_search_text(item_data.get(key, ""))
+
+        for token in tokens: # 登记到倒排表，新词加入词表
+            postings = self.history_index.get(token)
+            if postings is None:
+                postings = self.history_index[token] = set()
+                if keep_sorted:
+                    bisect.insort(self.history_vocab, token)
+                else:
+                    self.history_vocab.append(token)
+            postings.add(record_id)
+
+        try:
+            amount = float(str(entry["总金额"]).replace(",", "")) # 总金额数值，用于金额范围过滤
+        except ValueError:
+            amount = 0.0
+        self.history_tokens[record_id] = tokens
+        self.history_meta[record_id] = (entry["时间"], amount, entry["总金额"], entry["毛利率"])
+        return record_id
+
+    def unindex_history_entry(self, record_id):
+        """从倒排索引中移除一条历史报价单"""
+        for token in self.history_tokens.pop(record_id, ()):
+            postings = self.history_index.get(token)
+            if postings is None:
+                continue
+            postings.discard(record_id)
+            if not postings: # 没有报价单再包含该词时，从词表中移除
+                del self.history_index[token]
+                index = bisect.bisect_left(self.history_vocab, token)
+                if index < len(self.history_vocab) and self.history_vocab[index] == token:
+                    del self.history_vocab[index]
+        self.history_meta.pop(record_id, None)
+        self.history_ids.remove(record_id)
+
+    def lookup_history_token(self, token):
+        """查找包含某个检索词的报价单；字母数字词按前缀匹配，例如 "abc1" 可匹配 "abc123" """
+        if not token.isascii():
+            return self.history_index.get(token, set())
+
+        matched = set()
+        index = bisect.bisect_left(self.history_vocab, token)
+        while index < len(self.history_vocab) and self.history_vocab[index].startswith(token):
+            matched |= self.history_index[self.history_vocab[index]]
+            index += 1
+        return matched
+
+    def search_history(self, event=None):
+        """根据关键词、日期范围和金额范围检索历史报价单，并刷新历史记录表格"""
+        query_tokens = self.tokenize_search_text(self.history_search_var.get().strip())
+        try:
+            # 日期统一为 YYYY-MM-DD 后再与时间戳前10位比较，2025-1-5 与 2025-01-05 等价
+            date_from = datetime.strptime(self.history_date_from.get().strip(), "%Y-%m-%d").strftime("%Y-%m-%d") if self.history_date_from.get().strip() else None
+            date_to = datetime.strptime(self.history_date_to.get().strip(), "%Y-%m-%d").strftime("%Y-%m-%d") if self.history_date_to.get().strip() else None
+        except ValueError:
+            return # 日期输入不完整时不检索
+        try:
+            amount_min = float(self.history_amount_min.get().replace(",", "")) if self.history_amount_min.get().strip() else None
+            amount_max = float(self.history_amount_max.get().replace(",", "")) if self.history_amount_max.get().strip() else None
+        except ValueError:
+            return # 金额输入不完整时不检索
+
+        # 关键词：各检索词结果取交集，从结果最少的词开始
+        if query_tokens:
+            postings = sorted((self.lookup_history_token(token) for token in query_tokens), key=len)
+            matched = set(postings[0])
+            for posting in postings[1:]:
+                if not matched:
+                    break
+                matched &= posting
+        else:
+            matched = self.history_meta.keys()
+
+        results = []
+        for record_id in sorted(matched): # 记录ID按保存顺序分配，即历史记录文件中的顺序
+            time_str, amount, amount_str, margin_str = self.history_meta[record_id]
+            if date_from and time_str[:10] < date_from:
+                continue
+            if date_to and time_str[:10] > date_to:
+                continue
+            if amount_min is not None and amount < amount_min:
+                continue
+            if amount_max is not None and amount > amount_max:
+                continue
+            results.append((record_id, (time_str, amount_str, margin_str, "删除")))
+
+        # 刷新历史记录表格
+        self.history_tree.delete(*self.history_tree.get_children())
+        for record_id, values in results:
+            self.history_tree.insert("", "end", iid=str(record_id), values=values)
+
+    def reset_history_search(self):
+        """清空检索条件并显示全部历史记录"""
+        self.history_search_var.set("")
+        for entry in (self.history_date_from, self.history_date_to, self.history_amount_min, self.history_amount_max):
+            entry.delete(0, tk.END)
+        self.search_history()
 
     def export_excel(self):
         """导出报价单到Excel文件，使用模板，动态调整行数，自动序号，数值转换, 格式复制"""
@@ -481,17 +764,8 @@ class QuotationApp:
             wb = load_workbook(template_path)
             ws = wb.active
 
-            # 获取当前报价单数据
-            quotation_data = []
-            for item in self.quotation_tree.get_children():
-                values = self.quotation_tree.item(item, "values")
-                quotation_data.append({
-                    "物料名称": values[1],
-                    "规格型号": values[2],
-                    "数量": values[3],
-                    "含税单价": values[4],
-                    "小计": values[5]
-                })
+            # 获取当前报价单数据（分组展开为：分组标题行、组内各行、分组小计行）
+            quotation_data = self.collect_export_rows()
 
             start_row = 19
             end_row = 28
@@ -499,6 +773,7 @@ class QuotationApp:
             quotation_item_count = len(quotation_data)
 
             # 动态调整行数
+            rows_to_insert = 0
             if quotation_item_count > template_product_rows:
                 rows_to_insert = quotation_item_count - template_product_rows
                 insert_row_index = end_row + 1
@@ -518,11 +793,28 @@ class QuotationApp:
 
             # 清空并填充产品数据区域，并设置对齐方式和自动换行
             current_end_row = start_row + quotation_item_count - 1
+            line_no = 0 # 序号只计明细行
             for i, item in enumerate(quotation_data):
                 current_row = start_row + i
+                if item["类型"] != "明细":
+                    # 分组标题行和分组小计行：名称加粗，小计行填写分组小计
+                    cell_name = ws.cell(row=current_row, column=col_mapping["物料名称"])
+                    cell_name.value = item["物料名称"]
+                    cell_name.font = Font(bold=True)
+                    cell_name.alignment = Alignment(horizontal='left', vertical='center', indent=item["层级"]) # 按层级缩进
+                    for col_name in ("序号", "规格型号", "数量", "含税单价", "小计"):
+                        ws.cell(row=current_row, column=col_mapping[col_name]).value = None
+                    if item["类型"] == "小计":
+                        cell_subtotal = ws.cell(row=current_row, column=col_mapping["小计"])
+                        cell_subtotal.value = float(item["小计"].replace(",", ""))
+                        cell_subtotal.font = Font(bold=True)
+                        cell_subtotal.alignment = Alignment(horizontal='right', vertical='center')
+                    continue
+
                 # 自动填充序号
+                line_no += 1
                 cell_no = ws.cell(row=current_row, column=col_mapping["序号"])
-                cell_no.value = i + 1
+                cell_no.value = line_no
                 cell_no.alignment = Alignment(horizontal='center', vertical='center') # 序号居中对齐
 
                 # 填充物料名称
@@ -553,13 +845,14 @@ class QuotationApp:
 
             # 计算总价并填充 (应用 Total 行样式)
             total_amount = self.total_label.get().replace(",", "")
-            total_cell = ws.cell(row=29, column=col_mapping["小计"]) # **!!!  Total 行 行号再次确认为 29 !!!**
+            total_cell = ws.cell(row=29 + rows_to_insert, column=col_mapping["小计"]) # Total 行为模板第 29 行，插入行后随之下移
             if total_cell.coordinate not in ws.merged_cells.ranges:
                 try:
                     total_amount_float = float(total_amount)
                 except:
                     total_amount_float = 0.0
                 total_cell.value = total_amount_float
+            ws.cell(row=30 + rows_to_insert, column=4).value = f"=G{29 + rows_to_insert}" # 插入行不会调整公式，合计人民币指向下移后的 Total 行
 
 
             # 弹出保存文件对话框 (保持不变)
@@ -574,48 +867,589 @@ class QuotationApp:
             messagebox.showerror("导出失败", f"导出Excel文件时出错：{e}")
 
 
+    def register_catalog(self, name):
+        """将当前产品数据登记为一个产品库，并设为当前产品库"""
+        self.catalogs[name] = {
+            "products": self.full_product_data,
+            "pinyin_index": self.pinyin_index, # 首次拼音搜索时建立
+            "prices": pl.DataFrame({ # 比价用的价格表
+                "物料编码": [str(values[0]) for values in self.full_product_data],
+                "物料名称": [values[1] for values in self.full_product_data],
+                "含税单价": [float(values[4]) for values in self.full_product_data],
+            }),
+        }
+        self.active_catalog = name
+        self.cheapest_frame = None
+        self.catalog_combo.config(values=list(self.catalogs))
+        self.catalog_var.set(name)
+
+    def select_catalog(self, event=None):
+        """切换当前显示的产品库"""
+        name = self.catalog_var.get()
+        if self.import_queue is not None or name not in self.catalogs: # 导入过程中不允许切换
+            self.catalog_var.set(self.active_catalog or "")
+            return
+
+        catalog = self.catalogs[name]
+        self.full_product_data = catalog["products"]
+        self.pinyin_index = catalog["pinyin_index"]
+        self.active_catalog = name
+        self.filter_products() # 按当前搜索条件显示
+
+    def remove_catalog(self):
+        """移除当前产品库，切换到剩余的第一个产品库"""
+        if self.import_queue is not None or self.active_catalog not in self.catalogs:
+            return
+        del self.catalogs[self.active_catalog]
+        self.cheapest_frame = None
+        self.catalog_combo.config(values=list(self.catalogs))
+
+        if self.catalogs:
+            self.catalog_var.set(next(iter(self.catalogs)))
+            self.select_catalog()
+        else:
+            self.full_product_data = []
+            self.pinyin_index = None
+            self.active_catalog = None
+            self.catalog_var.set("")
+            self.filter_products()
+
+    def get_cheapest_frame(self):
+        """汇总所有产品库，得到每个物料编码的最低含税单价及其产品库；结果缓存到产品库变化为止"""
+        if self.cheapest_frame is None:
+            all_prices = pl.concat([
+                catalog["prices"].with_columns(pl.lit(name).alias("产品库"))
+                for name, catalog in self.catalogs.items()
+            ], rechunk=False) # 不合并内存块，直接引用各产品库的价格表
+            self.cheapest_frame = all_prices.group_by("物料编码").agg(
+                pl.col("物料名称").first(),
+                pl.col("含税单价").min().alias("最低单价"),
+                pl.col("产品库").sort_by("含税单价").first().alias("最低价产品库"),
+                pl.len().alias("报价产品库数"),
+            )
+        return self.cheapest_frame
+
+    def compare_catalog_prices(self, lines):
+        """将明细行与所有产品库按物料编码一次性关联，找出每行的最低价和可节省金额
+
+        lines 包含 物料编码、数量 两列，可选 当前单价；没有当前单价时以当前产品库的价格为准。
+        """
+        if "当前单价" not in lines.columns:
+            active_prices = self.catalogs[self.active_catalog]["prices"] if self.active_catalog in self.catalogs else \
+                pl.DataFrame(schema={"物料编码": pl.String, "物料名称": pl.String, "含税单价": pl.Float64})
+            lines = lines.join(active_prices.select("物料编码", pl.col("含税单价").alias("当前单价")), on="物料编码", how="left")
+
+        result = lines.with_row_index("序号").join(
+            self.get_cheapest_frame(), on="物料编码", how="left", suffix="_产品库"
+        ).sort("序号").with_columns( # 当前价已是最低时不计节省
+            ((pl.col("当前单价") - pl.col("最低单价")) * pl.col("数量")).clip(lower_bound=0).round(2).alias("可节省金额")
+        )
+        if "物料名称_产品库" in result.columns: # 报价单自带物料名称，缺失时用产品库中的名称
+            result = result.with_columns(pl.coalesce("物料名称", "物料名称_产品库").alias("物料名称"))
+        return result.select("物料编码", "物料名称", "数量", "当前单价", "最低单价", "最低价产品库", "报价产品库数", "可节省金额")
+
+    def get_quotation_lines(self):
+        """读取当前报价单的明细行，返回 Polars DataFrame"""
+        rows = [self.quotation_tree.item(item, "values") for item in self.iter_quotation_lines()]
+        return pl.DataFrame({
+            "物料编码": [str(values[0]) for values in rows],
+            "物料名称": [str(values[1]) for values in rows],
+            "数量": [float(values[3]) for values in rows],
+            "当前单价": [float(str(values[4]).replace(",", "")) for values in rows],
+        }, schema={"物料编码": pl.String, "物料名称": pl.String, "数量": pl.Float64, "当前单价": pl.Float64})
+
+    def parse_bom_text(self, text):
+        """解析从 Excel 粘贴的 BOM：每行 物料编码 [数量]，以制表符、逗号或空格分隔；数量不是数字的行（如表头）跳过"""
+        codes, quantities = [], []
+        for line in text.splitlines():
+            parts = [part for part in re.split(r"[\t,，\s]+", line.strip()) if part]
+            if not parts:
+                continue
+            try:
+                quantity = float(parts[1].replace(",", "")) if len(parts) > 1 else 1.0
+            except ValueError:
+                continue
+            codes.append(parts[0])
+            quantities.append(quantity)
+        return pl.DataFrame({"物料编码": codes, "数量": quantities}, schema={"物料编码": pl.String, "数量": pl.Float64})
+
+    def open_catalog_comparison(self):
+        """打开多产品库比价窗口：对当前报价单或粘贴的 BOM，找出每行在各产品库中的最低价"""
+        if self.import_queue is not None: # 导入过程中产品数据不完整
+            return
+        if not self.catalogs:
+            messagebox.showerror("错误", "请先导入产品数据！")
+            return
+
+        window = tk.Toplevel(self.root)
+        window.title(f"多库比价（{len(self.catalogs)} 个产品库）")
+        window.geometry("1000x600")
+
+        # BOM 输入框
+        tk.Label(window, text="粘贴 BOM（每行：物料编码 数量），留空则比价当前报价单：", font=self.font_style).pack(anchor="w", padx=10, pady=(5, 0))
+        bom_text = tk.Text(window, height=6, font=self.info_font)
+        bom_text.pack(fill=tk.X, padx=10, pady=5)
+
+        # 结果表格
+        columns = ("物料编码", "物料名称", "数量", "当前单价", "最低单价", "最低价产品库", "报价产品库数", "可节省金额")
+        result_tree = ttk.Treeview(window, columns=columns, show="headings")
+        for col, width in zip(columns, (120, 180, 60, 90, 90, 150, 90, 100)):
+            result_tree.heading(col, text=col)
+            result_tree.column(col, width=width, anchor="center")
+
+        summary_label = tk.Label(window, text="", font=self.bold_font)
+
+        def run_comparison():
+            """执行比价并显示结果"""
+            bom = bom_text.get(1.0, tk.END).strip()
+            try:
+                lines = self.parse_bom_text(bom) if bom else self.get_quotation_lines()
+            except ValueError:
+                messagebox.showerror("错误", "报价单中有无效的数量或单价！", parent=window)
+                return
+            result = self.compare_catalog_prices(lines)
+
+            result_tree.delete(*result_tree.get_children())
+            for row in result.iter_rows(named=True):
+                values = [row[col] for col in columns]
+                values[2] = f"{row['数量']:g}"
+                result_tree.insert("", "end", values=tuple(
+                    "" if value is None else f"{value:,.2f}" if isinstance(value, float) else value for value in values
+                ))
+
+            current_total = (result["当前单价"] * result["数量"]).sum()
+            savings = result["可节省金额"].sum()
+            missing = result["最低单价"].null_count()
+            summary_label.config(text=f"共 {result.height} 行，当前合计 {current_total:,.2f}，按最低价可节省 {savings:,.2f}"
+                                      + (f"，{missing} 行在所有产品库中都找不到" if missing else ""))
+
+        btn_frame = tk.Frame(window)
+        btn_frame.pack(fill=tk.X, padx=10)
+        tk.Button(btn_frame, text="比价", font=self.font_style, command=run_comparison).pack(side=tk.LEFT, padx=5)
+        summary_label.pack(in_=btn_frame, side=tk.LEFT, padx=10)
+
+        scrollbar = ttk.Scrollbar(window, orient=tk.VERTICAL, command=result_tree.yview)
+        result_tree.configure(yscroll=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y, padx=(0, 10), pady=5)
+        result_tree.pack(fill=tk.BOTH, expand=True, padx=(10, 0), pady=5)
+
+        run_comparison()
+
+    def reprice_history(self):
+        """将所有历史报价单按物料编码与当前产品数据重新定价，导出差异报告，并可选择另存为新的历史记录"""
+        if self.import_queue is not None: # 导入过程中产品数据不完整，不能按其定价
+            return
+        if not self.full_product_data: # 需要先导入新的产品数据
+            messagebox.showerror("错误", "请先导入产品数据！")
+            return
+
+        with open(self.history_file, "r", encoding="utf-8") as file: # 读取全部历史记录
+            history = json.load(file)
+
+        # 将所有原始历史报价单展开为明细行（重新定价生成的副本不再重复定价），按记录在文件中的位置区分报价单
+        record_nos, times, line_nos, codes, names, specs, quantities, prices = [], [], [], [], [], [], [], []
+        for record_no, entry in enumerate(history):
+            if "重新定价来源" in entry:
+                continue
+            for line_no, item_data in enumerate(entry.get("报价单详情", [])):
+                record_nos.append(record_no)
+                times.append(entry["时间"])
+                line_nos.append(line_no)
+                codes.append(str(item_data["物料编码"]))
+                names.append(str(item_data["物料名称"]))
+                specs.append(str(item_data["规格型号"]))
+                quantities.append(str(item_data["数量"]))
+                prices.append(str(item_data["含税单价"]))
+        if not times:
+            messagebox.showinfo("提示", "没有可重新定价的历史报价单。")
+            return
+
+        lines = pl.DataFrame({
+            "记录号": record_nos, "时间": times, "行号": line_nos, "物料编码": codes, "物料名称": names,
+            "规格型号": specs, "数量文本": quantities, "原含税单价": prices
+        }).with_row_index("序号").with_columns(
+            pl.col("数量文本").str.replace_all(",", "").cast(pl.Float64, strict=False).fill_null(0.0).alias("数量"),
+            pl.col("原含税单价").str.replace_all(",", "").cast(pl.Float64, strict=False).fill_null(0.0),
+        )
+
+        # 当前产品数据，物料编码重复时取第一条
+        catalog = pl.DataFrame({
+            "物料编码": [str(values[0]) for values in self.full_product_data],
+            "新含税单价": [str(values[4]) for values in self.full_product_data],
+        }).with_columns(
+            pl.col("新含税单价").str.replace_all(",", "").cast(pl.Float64, strict=False)
+        ).unique("物料编码", keep="first", maintain_order=True)
+
+        # 按物料编码一次性关联，计算每行的新旧单价和小计差额；产品数据中找不到的物料保持原价
+        joined = lines.join(catalog, on="物料编码", how="left").sort("序号").with_columns(
+            pl.col("新含税单价").is_null().alias("未找到"),
+            pl.col("新含税单价").fill_null(pl.col("原含税单价")),
+        ).with_columns(
+            (pl.col("数量") * pl.col("原含税单价")).round(2).alias("原小计"),
+            (pl.col("数量") * pl.col("新含税单价")).round(2).alias("新小计"),
+            (pl.col("新含税单价") - pl.col("原含税单价")).round(2).alias("单价差额"),
+        ).with_columns(
+            (pl.col("新小计") - pl.col("原小计")).round(2).alias("小计差额")
+        )
+
+        # 按报价单汇总新旧总金额
+        summary = joined.group_by("记录号", maintain_order=True).agg(
+            pl.col("时间").first(),
+            pl.col("原小计").sum().round(2).alias("原总金额"),
+            pl.col("新小计").sum().round(2).alias("新总金额"),
+            (pl.col("小计差额") != 0).sum().alias("变动行数"),
+            pl.col("未找到").sum().alias("未找到行数"),
+        ).with_columns(
+            (pl.col("新总金额") - pl.col("原总金额")).round(2).alias("总金额差额")
+        )
+        changed_records = summary.filter(pl.col("变动行数") > 0)["记录号"]
+        if changed_records.is_empty():
+            messagebox.showinfo("批量重新定价", f"共检查 {summary.height} 份报价单，价格均无变动。")
+            return
+
+        # 导出差异报告：汇总表 + 变动明细表（CSV 带 BOM，可直接用 Excel 打开，数据量大时也能快速写出）
+        file_path = filedialog.asksaveasfilename(
+            title="保存重新定价报告",
+            initialfile="重新定价报告.csv",
+            defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv")]
+        )
+        if file_path:
+            detail_report = joined.filter((pl.col("小计差额") != 0) | pl.col("未找到")).select(
+                "时间", "物料编码", "物料名称", "规格型号", "数量", "原含税单价", "新含税单价",
+                "单价差额", "原小计", "新小计", "小计差额", "未找到"
+            )
+            details_path = str(Path(file_path).with_name(Path(file_path).stem + "_明细.csv"))
+            try:
+                summary.drop("记录号").write_csv(file_path, include_bom=True)
+                detail_report.write_csv(details_path, include_bom=True)
+            except Exception as e:
+                messagebox.showerror("导出失败", f"导出重新定价报告时出错：{e}")
+                return
+
+        # 已按当前价格另存过的报价单不再重复另存：比较已有副本与本次新单价
+        saved_prices = {} # 原报价单时间 -> 已有副本的单价列表
+        for entry in history:
+            if "重新定价来源" in entry:
+                saved_prices.setdefault(entry["重新定价来源"], []).append(
+                    [str(item_data["含税单价"]) for item_data in entry.get("报价单详情", [])])
+        new_groups = []
+        for group in joined.filter(pl.col("记录号").is_in(changed_records.to_list())).partition_by("记录号", maintain_order=True):
+            new_prices = [f"{price:.2f}" for price in group["新含税单价"]]
+            if new_prices not in saved_prices.get(group["时间"][0], []):
+                new_groups.append(group)
+        existing_count = len(changed_records) - len(new_groups)
+        if not new_groups:
+            messagebox.showinfo("批量重新定价", f"共 {summary.height} 份报价单，其中 {len(changed_records)} 份价格有变动，均已有按当前价格另存的副本。")
+            return
+
+        # 可选：将价格有变动的报价单按新价格另存为新的历史记录
+        existing_note = f"\n（另有 {existing_count} 份已有按当前价格另存的副本，将跳过）" if existing_count else ""
+        if not messagebox.askyesno("批量重新定价", f"共 {summary.height} 份报价单，其中 {len(changed_records)} 份价格有变动。{existing_note}\n是否将 {len(new_groups)} 份按新价格另存为新的历史记录？"):
+            return
+
+        new_totals = dict(summary.select("记录号", "新总金额").iter_rows())
+        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        new_entries = []
+        for i, group in enumerate(new_groups):
+            record_no = group["记录号"][0]
+            source = history[record_no]
+            new_entries.append({
+                "时间": f"{current_time}.{i:05d}", # 同一批次内保持时间戳唯一
+                "总金额": f"{new_totals[record_no]:.2f}",
+                "毛利率": source.get("毛利率", "0.00%"),
+                "报价单详情": [{
+                    "物料编码": row["物料编码"],
+                    "物料名称": row["物料名称"],
+                    "规格型号": row["规格型号"],
+                    "数量": row["数量文本"],
+                    "含税单价": f"{row['新含税单价']:.2f}",
+                    "小计": f"{row['新小计']:.2f}",
+                    "分组编号": source["报价单详情"][row["行号"]].get("分组编号", 0) # 保留原报价单的分组
+                } for row in group.iter_rows(named=True)],
+                "分组结构": source.get("分组结构", []),
+                "重新定价来源": source["时间"]
+            })
+
+        # 一次性写回历史记录文件，更新检索索引并按当前检索条件刷新历史记录表格
+        history.extend(new_entries)
+        with open(self.history_file, "w", encoding="utf-8") as file:
+            json.dump(history, file, ensure_ascii=False, indent=4)
+        for entry in new_entries:
+            self.index_history_entry(entry)
+        self.search_history()
+        messagebox.showinfo("批量重新定价", f"已另存 {len(new_entries)} 份重新定价后的报价单。")
+
+    def collect_export_rows(self, parent="", depth=0):
+        """按报价单顺序展开导出行：明细行原样输出，分组输出标题行、组内各行和小计行"""
+        rows = []
+        for item in self.quotation_tree.get_children(parent):
+            values = self.quotation_tree.item(item, "values")
+            if self.is_quotation_group(item):
+                name = self.quotation_tree.item(item, "text")
+                rows.append({"类型": "分组", "层级": depth, "物料名称": name})
+                rows.extend(self.collect_export_rows(item, depth + 1))
+                rows.append({"类型": "小计", "层级": depth, "物料名称": f"{name} 小计", "小计": str(values[5])})
+            else:
+                rows.append({
+                    "类型": "明细",
+                    "层级": depth,
+                    "物料名称": values[1],
+                    "规格型号": values[2],
+                    "数量": values[3],
+                    "含税单价": str(values[4]),
+                    "小计": str(values[5])
+                })
+        return rows
+
     def import_excel(self):
         """导入Excel产品数据到产品表格"""
+        if self.import_queue is not None: # 已有导入正在进行
+            return
+
         file_path = filedialog.askopenfilename( # 弹出文件选择对话框，让用户选择Excel文件
             title="选择 Excel 文件", # 对话框标题
             filetypes=[("Excel files", "*.xlsx *.xls")] # 文件类型过滤器，只显示Excel文件
         )
 
         if file_path: # 如果用户选择了文件
-            success, message = self.load_excel_data(file_path) # 调用 load_excel_data 函数加载Excel数据
-            if success: # 如果加载成功
-                messagebox.showinfo("导入成功", message) # 弹出导入成功提示框
-            else: # 如果加载失败
-                messagebox.showerror("导入失败", message) # 弹出导入失败错误提示框
+            self.load_excel_data(file_path) # 在后台加载Excel数据，结果分块显示
 
     def load_excel_data(self, file_path):
-        """加载Excel数据到产品表格，并处理数据格式"""
+        """开始在后台线程加载Excel数据，界面线程分块接收并显示，可随时取消"""
+        # 导入完成后以文件名作为产品库名称，同名产品库会被替换
+        self.import_catalog_name = Path(file_path).stem
+
+        # 暂存当前产品数据，取消或失败时恢复
+        self.import_backup = (self.full_product_data, self.pinyin_index)
+
+        # 清空现有产品表格和完整产品数据，新数据到达后即可搜索
+        self.product_tree.delete(*self.product_tree.get_children())
+        self.full_product_data = []
+        self.pinyin_index = None
+
+        # 显示进度条
+        self.import_progress.config(value=0, maximum=1, mode="determinate")
+        self.import_status_label.config(text="正在读取文件...")
+        self.import_progress_frame.pack(side=tk.LEFT, padx=5)
+        self.btn_import.config(state="disabled")
+
+        # 启动解析线程
+        self.import_queue = queue.Queue()
+        self.import_cancel_event = threading.Event()
+        self.import_start_time = time.perf_counter()
+        threading.Thread(
+            target=self.read_excel_chunks,
+            args=(file_path, self.import_queue, self.import_cancel_event, self.pinyin_mode_var.get()),
+            daemon=True
+        ).start()
+        self.root.after(50, self.poll_import_queue, self.import_queue)
+
+    def read_excel_chunks(self, file_path, result_queue, cancel_event, build_pinyin):
+        """后台线程：逐块读取Excel数据并放入队列，不访问任何界面元素
+
+        build_pinyin 为 True（开始导入时处于拼音搜索模式）时，同时计算每块的拼音检索文本，界面线程只需追加。
+        """
+        required_columns = list(self.COLUMN_MAPPING.keys()) # 获取必需的列名列表
+        workbook = None
         try:
-            # 强制将“规格型号”列读取为字符串类型，避免可能的类型推断错误
-            df = pd.read_excel(file_path, dtype={"规格型号": str}) # 读取Excel文件到DataFrame
+            if file_path.lower().endswith(".xlsx"):
+                # xlsx 使用只读模式流式读取，不必等整个文件解析完
+                workbook = load_workbook(file_path, read_only=True, data_only=True)
+                worksheet = workbook.active
+                rows = worksheet.iter_rows(values_only=True)
+                header = [str(cell).strip() if cell is not None else "" for cell in next(rows, ())]
+                total = worksheet.max_row - 1 if worksheet.max_row else None # 部分文件没有记录行数
+            else:
+                # xls 只能整体读取，读取后再分块
+                df = pd.read_excel(file_path, dtype={"规格型号": str})
+                header = [str(col).strip() for col in df.columns]
+                rows = df.itertuples(index=False, name=None)
+                total = len(df)
 
             # 检查Excel文件是否包含必需的列
-            required_columns = list(self.COLUMN_MAPPING.keys()) # 获取必需的列名列表
-            if not all(col in df.columns for col in required_columns): # 检查所有必需列是否都存在于DataFrame中
-                return False, f"Excel 文件缺少必需的列：{required_columns}" # 如果缺少列，返回False和错误信息
+            if not all(col in header for col in required_columns):
+                result_queue.put(("error", f"Excel 文件缺少必需的列：{required_columns}"))
+                return
+            positions = [header.index(col) for col in required_columns] # 必需列在文件中的位置
+
+            batch = []
+            row_numbers = [] # 每行在Excel中的行号，用于错误报告
+            seen_codes = set() # 已导入的物料编码，用于跨块检查重复
+            error_frames = [] # 各批中被隔离的错误行
+            parsed = 0
+            imported = 0
+
+            def flush_batch():
+                """整批检查数据，有效行按 IMPORT_CHUNK_SIZE 分块放入队列"""
+                nonlocal parsed, imported
+                parsed += len(batch)
+                valid_rows, error_rows = self.validate_product_chunk(batch, row_numbers, seen_codes)
+                imported += len(valid_rows)
+                error_frames.append(error_rows)
+                for start in range(0, len(valid_rows), self.IMPORT_CHUNK_SIZE):
+                    chunk = valid_rows[start:start + self.IMPORT_CHUNK_SIZE]
+                    texts = [self.get_product_search_text(values) for values in chunk] if build_pinyin else None
+                    result_queue.put(("rows", chunk, texts, parsed, total))
+                result_queue.put(("rows", [], None, parsed, total)) # 更新进度（整批无效时也能前进）
+
+            for row_number, row in enumerate(rows, start=2): # 第1行为表头
+                if cancel_event.is_set(): # 用户取消导入
+                    return
+                batch.append([row[position] if position < len(row) else None for position in positions])
+                row_numbers.append(row_number)
+                if len(batch) >= self.IMPORT_VALIDATE_SIZE:
+                    flush_batch()
+                    batch = []
+                    row_numbers = []
+            flush_batch()
+
+            # 写出错误报告
+            errors = pd.concat(error_frames, ignore_index=True)
+            report_path = self.write_import_error_report(file_path, errors) if len(errors) else None
+            result_queue.put(("done", imported, len(errors), report_path))
+        except Exception as e: # 捕获加载Excel数据过程中的异常
+            result_queue.put(("error", f"导入 Excel 文件时出错：{e}"))
+        finally:
+            if workbook is not None:
+                workbook.close()
+
+    def validate_product_chunk(self, rows, row_numbers, seen_codes):
+        """整块检查产品数据：含税单价、数量、物料编码和规格型号，返回 (有效行列表, 错误行DataFrame)
+
+        空行直接跳过；物料编码重复时保留第一条有效数据，seen_codes 会加入本块有效行的物料编码。
+        """
+        required_columns = list(self.COLUMN_MAPPING.keys())
+        df = pd.DataFrame(rows, columns=required_columns, dtype=object)
+        df.insert(0, "行号", row_numbers)
+        text = df[required_columns].fillna("").astype(str).apply(lambda col: col.str.strip()) # 各列的文本形式
+        non_empty = (text != "").any(axis=1) # 跳过空行
+        df = df[non_empty].reset_index(drop=True)
+        text = text[non_empty].reset_index(drop=True)
+
+        prices = pd.to_numeric(text["含税单价"].str.replace(",", "", regex=False), errors="coerce")
+        quantities = pd.to_numeric(text["数量"].str.replace(",", "", regex=False), errors="coerce")
+        # 物料编码统一为去空白的文本；.xls 中的数字编码读出为 12345.0，转换为 12345
+        codes = text["物料编码"].copy()
+        numeric_codes = df["物料编码"].map(lambda value: isinstance(value, float) and value.is_integer()).to_numpy(dtype=bool)
+        codes[numeric_codes] = df.loc[numeric_codes, "物料编码"].map("{:.0f}".format)
+        checks = [
+            (prices.isna(), "含税单价不是数字"),
+            (prices.notna() & ~np.isfinite(prices), "含税单价超出范围"), # inf、1e400 等
+            (prices < 0, "含税单价为负数"),
+            ((text["数量"] != "") & (quantities.isna() | (quantities % 1 != 0) | (quantities < 0)), "数量不是非负整数"),
+            (codes == "", "物料编码为空"),
+            (text["规格型号"].str.len() > self.MAX_SPEC_LENGTH, f"规格型号超过{self.MAX_SPEC_LENGTH}个字符"),
+        ]
+        masks = [mask.to_numpy(dtype=bool) for mask, _ in checks]
+        invalid = np.logical_or.reduce(masks)
+
+        # 在其余检查通过的行中检查物料编码重复（包括与之前各块重复），直接查集合，避免每块复制全部已导入编码
+        passed_codes = codes[~invalid]
+        duplicated = np.zeros(len(df), dtype=bool)
+        duplicated[~invalid] = passed_codes.map(seen_codes.__contains__).to_numpy(dtype=bool) | passed_codes.duplicated().to_numpy()
+        valid = ~(invalid | duplicated)
+        seen_codes.update(codes[valid])
+
+        # 有效行按产品表格格式输出，物料编码使用检查时的统一文本，含税单价保留两位小数
+        # 文本驻留（sys.intern），多个产品库中相同的名称、型号和价格共用同一个字符串对象
+        valid_rows = [list(values) for values in zip(
+            codes[valid].tolist(),
+            map(sys.intern, text.loc[valid, "物料名称"].tolist()),
+            map(sys.intern, text.loc[valid, "规格型号"].tolist()),
+            df.loc[valid, "数量"].fillna("").tolist(),
+            map(sys.intern, prices[valid].map("{:.2f}".format).tolist()),
+        )]
+
+        # 错误行通常很少，只为这些行拼接错误原因
+        reasons = [
+            "；".join(reason for mask, (_, reason) in zip(masks, checks) if mask[i]) or "物料编码重复"
+            for i in np.flatnonzero(~valid)
+        ]
+        error_rows = df[~valid].assign(错误原因=reasons)
+        return valid_rows, error_rows
+
+    def write_import_error_report(self, file_path, errors):
+        """将导入时被隔离的错误行写入CSV报告，优先放在导入文件旁边，返回报告路径"""
+        report_name = f"{Path(file_path).stem}_导入错误报告_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
+        for folder in (Path(file_path).parent, Path(self.history_file).parent): # 导入文件目录不可写时放在应用数据目录
+            report_path = folder / report_name
+            try:
+                errors.to_csv(report_path, index=False, encoding="utf-8-sig")
+                return str(report_path)
+            except OSError:
+                continue
+        return None
+
+    def poll_import_queue(self, result_queue):
+        """界面线程：每次从队列取出一块数据加入产品数据和产品表格，然后让出界面事件循环"""
+        if result_queue is not self.import_queue: # 该次导入已取消或已结束
+            return
+
+        try:
+            message = result_queue.get_nowait()
+        except queue.Empty:
+            self.root.after(50, self.poll_import_queue, result_queue) # 暂无数据，稍后再取
+            return
 
-            # 清空现有产品表格
-            self.product_tree.delete(*self.product_tree.get_children()) # 删除产品表格的所有行
+        if message[0] == "error":
+            self.finish_import(restore=True)
+            messagebox.showerror("导入失败", message[1]) # 弹出导入失败错误提示框
+            return
+        if message[0] == "done":
+            self.finish_import(restore=False)
+            self.register_catalog(self.import_catalog_name) # 保留为一个产品库，不影响其他已导入的产品库
+            _, imported, error_count, report_path = message
+            info = f"成功导入 {imported} 条产品数据！"
+            if error_count:
+                info += f"\n另有 {error_count} 条数据有误，已跳过。"
+                info += f"\n错误报告：{report_path}" if report_path else "\n错误报告保存失败。"
+            messagebox.showinfo("导入成功", info) # 弹出导入成功提示框
+            return
 
-            # 清空完整产品数据列表
-            self.full_product_data = []  # 清空完整数据，准备加载新数据
+        # 加入产品数据，新数据立即可搜索；解析线程已算好拼音检索文本时直接追加，否则在拼音搜索时补上
+        _, chunk, texts, parsed, total = message
+        start = len(self.full_product_data)
+        self.full_product_data.extend(chunk)
+        if texts:
+            self.append_pinyin_texts(start, texts)
+
+        # 显示新数据：无搜索条件时直接追加，有搜索条件时按当前条件过滤
+        search_term = self.search_var.get().strip().lower()
+        if not search_term:
+            for values in chunk:
+                self.product_tree.insert("", "end", values=values)
+        elif self.pinyin_mode_var.get():
+            self.filter_products() # 拼音结果需要重新排序，且只显示前 PINYIN_TOP_K 条
+        else:
+            for values in chunk:
+                if search_term in str(values[2]).lower():
+                    self.product_tree.insert("", "end", values=values)
 
-            # 遍历DataFrame的每一行，将数据加载到产品表格中
-            for index, row in df.iterrows(): # 遍历DataFrame的行
-                values = [row[col] for col in required_columns] # 提取每行中必需列的值，按COLUMN_MAPPING顺序
-                # 确保含税单价保留两位小数，并转换为字符串类型
-                values[4] = f"{float(values[4]):.2f}" # 格式化含税单价，保留两位小数
-                self.product_tree.insert("", "end", values=values) # 将数据插入产品表格末尾
-                self.full_product_data.append(values)  # 将数据添加到完整产品数据列表
+        # 更新进度和解析速度
+        elapsed = max(time.perf_counter() - self.import_start_time, 1e-6)
+        if total:
+            self.import_progress.config(maximum=total, value=min(parsed, total))
+        self.import_status_label.config(text=f"已解析 {parsed} 行，{parsed / elapsed:,.0f} 行/秒")
 
-            return True, f"成功导入 {len(df)} 条产品数据！" # 返回True和成功导入的消息
-        except Exception as e: # 捕获加载Excel数据过程中的异常
-            return False, f"导入 Excel 文件时出错：{e}" # 返回False和错误信息
+        self.root.after(1, self.poll_import_queue, result_queue)
+
+    def cancel_import(self):
+        """取消正在进行的导入，恢复导入前的产品数据"""
+        if self.import_queue is None:
+            return
+        self.import_cancel_event.set() # 通知解析线程停止
+        self.finish_import(restore=True)
+
+    def finish_import(self, restore):
+        """结束导入：隐藏进度条，必要时恢复导入前的产品数据"""
+        self.import_queue = None
+        self.import_progress_frame.pack_forget()
+        self.btn_import.config(state="normal")
+        if restore and self.import_backup is not None:
+            self.full_product_data, self.pinyin_index = self.import_backup
+            self.filter_products() # 按当前搜索条件重新显示原产品数据
+        self.import_backup = None
 
     def filter_products(self, event=None):
         """根据搜索框内容过滤产品表格"""
@@ -624,6 +1458,12 @@ class QuotationApp:
         # 清空当前显示的产品列表
         self.product_tree.delete(*self.product_tree.get_children()) # 删除产品表格的所有行，准备重新加载过滤后的数据
 
+        # 拼音搜索模式：使用预先建立的索引，按前缀优先排序
+        if self.pinyin_mode_var.get() and search_term:
+            for index in self.search_products_pinyin(search_term):
+                self.product_tree.insert("", "end", values=self.full_product_data[index])
+            return
+
         # 遍历完整的产品数据，进行过滤
         for values in self.full_product_data: # 遍历完整产品数据列表
             spec = str(values[2]).lower()  # 获取“规格型号”列的值，并转换为小写
@@ -632,6 +1472,84 @@ class QuotationApp:
             if not search_term or search_term in spec: # 检查是否满足过滤条件
                 self.product_tree.insert("", "end", values=values) # 将满足条件的产品数据插入产品表格
 
+    def get_pinyin_keys(self, text):
+        """将文本转换为 (全拼, 首字母) 两个检索键，非中文字符保持原样，去掉空白并转小写"""
+        full_parts = []
+        initial_parts = []
+        for segment in re.split(r"([\u4e00-\u9fff]+)", str(text).lower()): # 按中文片段切分，奇数位为中文
+            if not segment:
+                continue
+            if "\u4e00" <= segment[0] <= "\u9fff":
+                keys = self.pinyin_cache.get(segment) # 相同的中文片段只转换一次
+                if keys is None:
+                    keys = ("".join(lazy_pinyin(segment)), "".join(lazy_pinyin(segment, style=Style.FIRST_LETTER))) # 继电器 -> jidianqi, jdq
+                    self.pinyin_cache[segment] = keys
+                full_parts.append(keys[0])
+                initial_parts.append(keys[1])
+            else:
+                segment = "".join(segment.split()) # 型号、字母数字保持原样
+                full_parts.append(segment)
+                initial_parts.append(segment)
+        return "".join(full_parts), "".join(initial_parts)
+
+    def get_product_search_text(self, values):
+        """产品行的检索文本：物料名称、规格型号的全拼和首字母检索键，每个检索键以换行开头"""
+        keys = set(self.get_pinyin_keys(values[1]) + self.get_pinyin_keys(values[2])) # 物料名称、规格型号
+        return "".join("\n" + key for key in keys if key)
+
+    def update_pinyin_index(self):
+        """为尚未建立检索文本的产品行（首次拼音搜索时为全部产品行）补上检索文本和行起始位置"""
+        start = len(self.pinyin_index[1]) if self.pinyin_index is not None else 0
+        if start < len(self.full_product_data):
+            self.append_pinyin_texts(start, [self.get_product_search_text(values) for values in self.full_product_data[start:]])
+
+    def append_pinyin_texts(self, start, texts):
+        """将从第 start 行开始的产品行检索文本追加到拼音检索文本；中间缺少的行留到拼音搜索时再补"""
+        text, starts = self.pinyin_index if self.pinyin_index is not None else ("", np.zeros(0, dtype=np.int64))
+        if len(starts) != start:
+            return
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        new_starts = len(text) + np.concatenate(([0], np.cumsum(lengths[:-1]))) if texts else lengths
+        self.pinyin_index = (text + "".join(texts), np.concatenate((starts, new_starts)))
+        if self.import_queue is None and self.active_catalog in self.catalogs: # 导入过程中的产品数据尚未登记为产品库
+            self.catalogs[self.active_catalog]["pinyin_index"] = self.pinyin_index
+
+    def search_products_pinyin(self, search_term):
+        """按拼音、首字母或中文检索产品，返回产品行号：前缀匹配在前，包含匹配在后，各自按行号排序，最多 PINYIN_TOP_K 条"""
+        # 输入中的中文转换为全拼和首字母两种查询词（继电器 -> jidianqi、jdq），拼音、型号保持原样
+        terms = [term for term in dict.fromkeys(self.get_pinyin_keys(search_term)) if term]
+        if not terms:
+            return []
+        self.update_pinyin_index()
+        text, starts = self.pinyin_index
+
+        def scan(pattern, limit, exclude):
+            """在检索文本中依次查找 pattern，每行只取一次，凑满 limit 行即停止"""
+            hits = []
+            position = text.find(pattern)
+            while position >= 0 and len(hits) < limit:
+                row = int(np.searchsorted(starts, position, side="right")) - 1
+                if row not in exclude:
+                    hits.append(row)
+                position = text.find(pattern, int(starts[row + 1]) if row + 1 < len(starts) else len(text)) # 跳到下一行
+            return hits
+
+        # 前缀匹配：查找以换行开头的查询词，即某个检索键的开头
+        prefix_hits = set()
+        for term in terms:
+            prefix_hits.update(scan("\n" + term, self.PINYIN_TOP_K, ()))
+        results = sorted(prefix_hits)[:self.PINYIN_TOP_K]
+        terms = [term for term in terms if len(term) >= 2]
+        if len(results) >= self.PINYIN_TOP_K or not terms:
+            return results
+
+        # 包含匹配：查询词出现在检索键中间
+        limit = self.PINYIN_TOP_K - len(results)
+        infix_hits = set()
+        for term in terms:
+            infix_hits.update(scan(term, limit, prefix_hits))
+        return results + sorted(infix_hits)[:limit]
+
     def add_to_quotation(self, event):
         """双击产品列表中的产品，将其添加到报价单表格"""
         selected_item = self.product_tree.selection() # 获取产品表格中选中的行
@@ -646,11 +1564,18 @@ class QuotationApp:
         quantity = 1  # 默认数量为 1
         unit_price = float(item_values[4])  # 含税单价
 
-        # 检查报价单表格中是否已存在相同物料编码的产品
+        # 添加到报价单中选中的分组（选中明细行时为其所在分组），未选中则添加到顶层
+        parent = ""
+        quotation_selection = self.quotation_tree.selection()
+        if quotation_selection:
+            selected = quotation_selection[0]
+            parent = selected if self.is_quotation_group(selected) else self.quotation_tree.parent(selected)
+
+        # 检查同一分组中是否已存在相同物料编码的产品（不同柜体中可以有相同物料）
         existing_item = None
-        for item in self.quotation_tree.get_children(): # 遍历报价单表格的所有行
+        for item in self.quotation_tree.get_children(parent): # 遍历该分组的直接下级行
             values = self.quotation_tree.item(item, "values") # 获取每行的数据
-            if values[0] == material_code:  # 通过物料编码判断是否已存在相同产品
+            if not self.is_quotation_group(item) and str(values[0]) == str(material_code):  # 通过物料编码判断是否已存在相同产品
                 existing_item = item # 如果已存在，则记录该行
                 break # 找到已存在的行后，跳出循环
 
@@ -659,15 +1584,17 @@ class QuotationApp:
             existing_values = self.quotation_tree.item(existing_item, "values") # 获取已存在行的数据
             new_quantity = int(existing_values[3]) + quantity  # 新数量 = 原有数量 + 默认数量
             subtotal = new_quantity * unit_price  # 重新计算小计
-            self.quotation_tree.item(existing_item, values=( # 更新已存在行的数据
-                material_code, material_name, spec, new_quantity, f"{unit_price:.2f}", f"{subtotal:.2f}", "删除"
-            ))
+            values = (material_code, material_name, spec, new_quantity, f"{unit_price:.2f}", f"{subtotal:.2f}", "删除")
+            self.quotation_tree.item(existing_item, values=values) # 更新已存在行的数据
+            self.adjust_group_subtotals(parent, subtotal - float(existing_values[5])) # 只更新上级分组小计
+            self.journal_record({"op": "set", "id": existing_item, "parent": parent, "values": values}) # 记录到自动保存日志
         else: # 如果报价单中不存在相同产品
             # 如果不存在，则新增一行
             subtotal = quantity * unit_price  # 计算小计
-            self.quotation_tree.insert("", "end", values=( # 在报价单表格末尾插入新行
-                material_code, material_name, spec, quantity, f"{unit_price:.2f}", f"{subtotal:.2f}", "删除"
-            ))
+            values = (material_code, material_name, spec, quantity, f"{unit_price:.2f}", f"{subtotal:.2f}", "删除")
+            item = self.quotation_tree.insert(parent, "end", values=values) # 在分组末尾插入新行
+            self.adjust_group_subtotals(parent, subtotal) # 只更新上级分组小计
+            self.journal_record({"op": "set", "id": item, "parent": parent, "values": values}) # 记录到自动保存日志
 
         # 更新总价
         self.calculate_total() # 重新计算报价单总价
@@ -675,7 +1602,7 @@ class QuotationApp:
     def calculate_total(self, event=None):
         """计算报价表的总价，包括含税总价、大写金额和最终含税总价"""
         total = 0.0 # 初始化总价
-        for item in self.quotation_tree.get_children(): # 遍历报价单表格的所有行
+        for item in self.quotation_tree.get_children(): # 遍历报价单顶层行，分组行的小计已包含组内所有行
             values = self.quotation_tree.item(item, "values") # 获取每行的数据
             subtotal = float(values[5])  # 获取小计，并转换为浮点数
             total += subtotal # 累加小计到总价
@@ -709,17 +1636,378 @@ class QuotationApp:
         except ValueError:
             pass # 如果毛利率输入框内容无法转换为数字，则忽略，不计算最终总价
 
+    def is_quotation_group(self, item):
+        """判断报价单中的行是否为分组行"""
+        return "group" in self.quotation_tree.item(item, "tags")
+
+    def iter_quotation_lines(self, parent=""):
+        """按报价单顺序遍历 parent 下的所有明细行，返回行ID"""
+        for item in self.quotation_tree.get_children(parent):
+            if self.is_quotation_group(item):
+                yield from self.iter_quotation_lines(item)
+            else:
+                yield item
+
+    def insert_quotation_group(self, parent, name):
+        """在报价单中插入一个分组行，小计初始为0"""
+        return self.quotation_tree.insert(parent, "end", text=name, open=True,
+                                          values=("", "", "", "", "", "0.00", "删除"), tags=("group",))
+
+    def adjust_group_subtotals(self, parent, delta):
+        """明细行小计变化 delta 时，只更新 parent 及其各级上级分组的小计"""
+        while parent and delta:
+            values = list(self.quotation_tree.item(parent, "values"))
+            values[5] = f"{float(values[5]) + delta:.2f}"
+            self.quotation_tree.item(parent, values=values)
+            parent = self.quotation_tree.parent(parent)
+
+    def recompute_group_subtotals(self, parent=""):
+        """整体重算 parent 下各分组的小计（仅在加载或恢复整张报价单时使用），返回 parent 下的小计合计"""
+        total = 0.0
+        for item in self.quotation_tree.get_children(parent):
+            values = list(self.quotation_tree.item(item, "values"))
+            if self.is_quotation_group(item):
+                values[5] = f"{self.recompute_group_subtotals(item):.2f}"
+                self.quotation_tree.item(item, values=values)
+            total += float(values[5])
+        return total
+
+    def create_quotation_group(self):
+        """新建分组：选中的行（或分组）移入新分组，新分组放在第一个选中行所在的分组下"""
+        name = simpledialog.askstring("新建分组", "分组名称（如柜体、子组件）：", parent=self.root)
+        if not name or not name.strip():
+            return
+
+        # 只移动最上层的选中行，其下级行随之移动
+        selected = set(self.quotation_tree.selection())
+        items = [item for item in self.quotation_tree.selection() if not self.has_selected_ancestor(item, selected)]
+        parent = self.quotation_tree.parent(items[0]) if items else ""
+
+        group = self.insert_quotation_group(parent, name.strip())
+        self.journal_record({"op": "set", "id": group, "parent": parent, "group": True, "name": name.strip()}) # 记录到自动保存日志
+        for item in items:
+            self.move_quotation_item(item, group)
+        self.quotation_tree.selection_set(group)
+        self.calculate_total()
+
+    def has_selected_ancestor(self, item, selected):
+        """判断 item 的上级分组中是否有被选中的"""
+        parent = self.quotation_tree.parent(item)
+        while parent:
+            if parent in selected:
+                return True
+            parent = self.quotation_tree.parent(parent)
+        return False
+
+    def move_quotation_item(self, item, new_parent):
+        """将报价单行（或分组）移到 new_parent 末尾，原上级和新上级分组的小计增量更新"""
+        subtotal = float(self.quotation_tree.item(item, "values")[5])
+        self.adjust_group_subtotals(self.quotation_tree.parent(item), -subtotal)
+        self.quotation_tree.move(item, new_parent, "end")
+        self.adjust_group_subtotals(new_parent, subtotal)
+        self.journal_record({"op": "move", "id": item, "parent": new_parent}) # 记录到自动保存日志
+
+    def delete_quotation_items(self, items):
+        """删除报价单行；删除分组时连同其下所有行，上级分组小计增量更新"""
+        selected = set(items)
+        for item in items:
+            if not self.quotation_tree.exists(item) or self.has_selected_ancestor(item, selected): # 随上级分组一起删除
+                continue
+            self.adjust_group_subtotals(self.quotation_tree.parent(item), -float(self.quotation_tree.item(item, "values")[5]))
+            self.quotation_tree.delete(item) # 删除选中行
+            self.journal_record({"op": "delete", "id": item}) # 记录到自动保存日志
+
+    def on_profit_margin_change(self, event=None):
+        """毛利率输入变化时记录到自动保存日志，并重新计算总价"""
+        margin = self.profit_margin_entry.get()
+        if margin != self.journal_margin: # 光标移动等按键不改变内容，不记录
+            self.journal_record({"op": "margin", "value": margin})
+        self.calculate_total(event)
+
+    def journal_record(self, record):
+        """向自动保存日志追加一条报价单修改记录；记录数达到上限时改为写入快照"""
+        if record.get("op") == "margin":
+            self.journal_margin = record["value"]
+        try:
+            if self.journal_count >= self.JOURNAL_CHECKPOINT_INTERVAL or self.journal_handle is None:
+                self.journal_checkpoint() # 快照已包含本次修改后的报价单
+                return
+            self.journal_handle.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.journal_handle.flush() # 只刷新到系统缓冲区，保证单次记录远低于1毫秒
+            self.journal_count += 1
+        except OSError:
+            pass # 自动保存失败不影响正常编辑
+
+    def journal_checkpoint(self):
+        """将当前报价单整体写入快照，替换原日志文件，之后的修改继续追加"""
+        rows = self.collect_journal_rows()
+        self.journal_margin = self.profit_margin_entry.get()
+        snapshot = {"op": "checkpoint", "rows": rows, "margin": self.journal_margin}
+        try:
+            if self.journal_handle is not None:
+                self.journal_handle.close()
+            temp_file = self.journal_file + ".tmp"
+            with open(temp_file, "w", encoding="utf-8") as file: # 先写临时文件再替换，避免写入中断导致日志损坏
+                file.write(json.dumps(snapshot, ensure_ascii=False) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_file, self.journal_file)
+            self.journal_handle = open(self.journal_file, "a", encoding="utf-8")
+            self.journal_count = 0
+        except OSError:
+            self.journal_handle = None
+
+    def collect_journal_rows(self, parent=""):
+        """按报价单顺序收集快照行，上级分组在前"""
+        rows = []
+        for item in self.quotation_tree.get_children(parent):
+            if self.is_quotation_group(item):
+                rows.append({"id": item, "parent": parent, "group": True, "name": self.quotation_tree.item(item, "text")})
+                rows.extend(self.collect_journal_rows(item))
+            else:
+                rows.append({"id": item, "parent": parent, "values": list(self.quotation_tree.item(item, "values"))})
+        return rows
+
+    def restore_from_journal(self):
+        """启动时从自动保存日志重放修改记录，恢复上次未保存的报价单"""
+        rows = {} # 行ID -> 行记录（上级分组、行数据或分组名称），同一分组内按插入顺序排列
+        margin = ""
+        try:
+            with open(self.journal_file, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break # 最后一条记录可能在崩溃时只写了一半
+                    op = record.get("op")
+                    if op == "checkpoint":
+                        rows = {row["id"]: row for row in record["rows"]}
+                        margin = record.get("margin", "")
+                    elif op == "set":
+                        rows[record["id"]] = record
+                    elif op == "move":
+                        row = rows.pop(record["id"], None)
+                        if row is not None:
+                            row["parent"] = record["parent"]
+                            rows[record["id"]] = row # 移到新分组末尾
+                    elif op == "delete":
+                        rows.pop(record["id"], None) # 其下级行因找不到上级分组，恢复时一并丢弃
+                    elif op == "clear":
+                        rows = {}
+                    elif op == "margin":
+                        margin = record["value"]
+        except OSError:
+            pass # 没有日志文件，无需恢复
+
+        # 按分组结构填充报价单，重算分组小计
+        children = {}
+        for row_id, row in rows.items():
+            children.setdefault(row["parent"], []).append(row_id)
+
+        def insert_children(old_parent, new_parent):
+            for row_id in children.get(old_parent, []):
+                row = rows[row_id]
+                if row.get("group"):
+                    insert_children(row_id, self.insert_quotation_group(new_parent, row["name"]))
+                else:
+                    self.quotation_tree.insert(new_parent, "end", values=row["values"])
+
+        insert_children("", "")
+        self.recompute_group_subtotals()
+
+        # 填充毛利率
+        self.profit_margin_entry.delete(0, tk.END)
+        self.profit_margin_entry.insert(0, margin)
+        if rows:
+            self.calculate_total()
+
+        # 以本次运行的行ID重新写入快照
+        self.journal_checkpoint()
+
+    def open_margin_sweep(self):
+        """打开毛利率测算窗口：一次计算多个毛利率下的最终含税总价并并排显示"""
+        window = tk.Toplevel(self.root)
+        window.title("毛利率测算")
+        window.geometry("520x500")
+
+        # 输入框架：毛利率范围或列表
+        input_frame = tk.Frame(window)
+        input_frame.pack(fill=tk.X, padx=10, pady=5)
+        tk.Label(input_frame, text="起始（%）：", font=self.font_style).grid(row=0, column=0, sticky="e")
+        start_entry = ttk.Entry(input_frame, width=8, font=self.font_style)
+        start_entry.insert(0, "5")
+        start_entry.grid(row=0, column=1, padx=2, pady=2)
+        tk.Label(input_frame, text="结束（%）：", font=self.font_style).grid(row=0, column=2, sticky="e")
+        end_entry = ttk.Entry(input_frame, width=8, font=self.font_style)
+        end_entry.insert(0, "40")
+        end_entry.grid(row=0, column=3, padx=2, pady=2)
+        tk.Label(input_frame, text="步长（%）：", font=self.font_style).grid(row=0, column=4, sticky="e")
+        step_entry = ttk.Entry(input_frame, width=8, font=self.font_style)
+        step_entry.insert(0, "0.5")
+        step_entry.grid(row=0, column=5, padx=2, pady=2)
+        tk.Label(input_frame, text="或列表：", font=self.font_style).grid(row=1, column=0, sticky="e")
+        list_entry = ttk.Entry(input_frame, font=self.font_style) # 例如 8, 12.5, 20，填写后优先使用
+        list_entry.grid(row=1, column=1, columnspan=5, sticky="we", padx=2, pady=2)
+
+        # 结果表格
+        columns = ("毛利率", "含税成本总价", "毛利额", "最终含税总价")
+        result_tree = ttk.Treeview(window, columns=columns, show="headings")
+        for col in columns:
+            result_tree.heading(col, text=col)
+            result_tree.column(col, width=110, anchor="center")
+        scrollbar = ttk.Scrollbar(window, orient=tk.VERTICAL, command=result_tree.yview)
+        result_tree.configure(yscroll=scrollbar.set)
+
+        sweep = {} # 最近一次测算结果，供导出使用
+
+        def run_sweep():
+            """解析输入并测算，结果一次性填入表格"""
+            try:
+                if list_entry.get().strip():
+                    margins = np.array([float(value) for value in re.split(r"[,，\s]+", list_entry.get().strip()) if value])
+                else:
+                    start, end, step = float(start_entry.get()), float(end_entry.get()), float(step_entry.get())
+                    if step <= 0 or end < start:
+                        raise ValueError
+                    if (end - start) / step + 1 > self.MAX_MARGIN_STEPS: # 先按步长估算个数，避免生成过大的数组
+                        messagebox.showerror("错误", f"毛利率个数超过 {self.MAX_MARGIN_STEPS} 个，请增大步长或缩小范围！", parent=window)
+                        return
+                    margins = np.round(np.arange(start, end + step / 2, step), 4) # 包含结束值
+            except ValueError:
+                messagebox.showerror("错误", "请输入有效的毛利率范围或列表！", parent=window)
+                return
+            if len(margins) > self.MAX_MARGIN_STEPS: # 手动输入的列表同样限制个数
+                messagebox.showerror("错误", f"毛利率个数超过 {self.MAX_MARGIN_STEPS} 个，请减少测算的毛利率！", parent=window)
+                return
+            cost_total, final_totals = self.compute_margin_sweep(margins)
+            sweep.update(margins=margins, cost_total=cost_total, final_totals=final_totals)
+
+            result_tree.delete(*result_tree.get_children())
+            for margin, final_total in zip(margins, final_totals):
+                result_tree.insert("", "end", values=(
+                    f"{margin:.2f}%", f"{cost_total:,.2f}", f"{final_total - cost_total:,.2f}", f"{final_total:,.2f}"
+                ))
+
+        def apply_margin(event):
+            """双击某一行，将该毛利率填入主界面"""
+            selected = result_tree.selection()
+            if not selected:
+                return
+            margin = result_tree.item(selected[0], "values")[0].rstrip("%")
+            self.profit_margin_entry.delete(0, tk.END)
+            self.profit_margin_entry.insert(0, margin)
+            self.on_profit_margin_change()
+
+        def export_sweep():
+            """导出测算结果"""
+            if not sweep:
+                run_sweep()
+            if sweep:
+                self.export_margin_comparison(sweep["margins"], sweep["cost_total"], sweep["final_totals"])
+
+        # 按钮框架
+        btn_frame = tk.Frame(window)
+        btn_frame.pack(fill=tk.X, padx=10, pady=5)
+        tk.Button(btn_frame, text="测算", font=self.font_style, command=run_sweep).pack(side=tk.LEFT, padx=5)
+        tk.Button(btn_frame, text="导出对比表", font=self.font_style, command=export_sweep).pack(side=tk.LEFT, padx=5)
+        tk.Label(btn_frame, text="双击结果行可应用该毛利率", font=self.font_style).pack(side=tk.LEFT, padx=10)
+
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y, padx=(0, 10), pady=5)
+        result_tree.pack(fill=tk.BOTH, expand=True, padx=(10, 0), pady=5)
+        result_tree.bind("<Double-1>", apply_margin)
+
+        run_sweep()
+
+    def compute_margin_sweep(self, margins):
+        """对报价单各行小计一次汇总，按毛利率数组批量计算最终含税总价，返回 (含税成本总价, 最终含税总价数组)"""
+        subtotals = np.array([float(str(self.quotation_tree.item(item, "values")[5]).replace(",", ""))
+                              for item in self.quotation_tree.get_children()], dtype=float)
+        cost_total = float(subtotals.sum())
+        final_totals = cost_total * (1 + np.asarray(margins, dtype=float) / 100) # 与 calculate_total 的计算方式一致
+        return cost_total, final_totals
+
+    def export_margin_comparison(self, margins, cost_total, final_totals):
+        """按 Quotation.xlsx 模板的版式导出毛利率对比表：每个毛利率一行"""
+        col_mapping = { # 列位置映射关系，沿用模板的产品区域
+            "序号": 2,
+            "毛利率": 3,
+            "大写金额": 4,
+            "毛利额": 5,
+            "含税成本总价": 6,
+            "最终含税总价": 7
+        }
+        try:
+            # 读取模板文件
+            template_path = "Quotation.xlsx"
+            wb = load_workbook(template_path)
+            ws = wb.active
+
+            start_row = 19
+            end_row = 28
+            header_row = 18
+            template_rows = end_row - start_row + 1
+            row_count = len(margins)
+
+            # 修改表头
+            for col_name, col_idx in col_mapping.items():
+                ws.cell(row=header_row, column=col_idx).value = col_name
+
+            # 动态调整行数
+            inserted_rows = 0
+            if row_count > template_rows:
+                inserted_rows = row_count - template_rows
+                ws.insert_rows(idx=end_row + 1, amount=inserted_rows)
+            for row_num in range(start_row, start_row + max(row_count, template_rows)): # 先清空产品区域
+                for col_idx in col_mapping.values():
+                    ws.cell(row=row_num, column=col_idx).value = None
+
+            # 填充测算结果
+            for i, (margin, final_total) in enumerate(zip(margins, final_totals)):
+                current_row = start_row + i
+                row_values = {
+                    "序号": i + 1,
+                    "毛利率": f"{margin:.2f}%",
+                    "大写金额": self.to_chinese_amount(float(final_total)),
+                    "毛利额": round(float(final_total) - cost_total, 2),
+                    "含税成本总价": round(cost_total, 2),
+                    "最终含税总价": round(float(final_total), 2)
+                }
+                for col_name, value in row_values.items():
+                    cell = ws.cell(row=current_row, column=col_mapping[col_name])
+                    cell.value = value
+                    horizontal = "right" if isinstance(value, float) else "center" # 金额右对齐，其余居中
+                    cell.alignment = Alignment(horizontal=horizontal, vertical="center", wrap_text=True)
+
+            # 合计行改为显示含税成本总价
+            total_row = 29 + inserted_rows
+            ws.cell(row=total_row, column=6).value = "成本总价："
+            ws.cell(row=total_row, column=7).value = round(cost_total, 2)
+            ws.cell(row=total_row + 1, column=4).value = f"=G{total_row}"
+
+            # 弹出保存文件对话框
+            file_path = filedialog.asksaveasfilename(
+                defaultextension=".xlsx",
+                initialfile="毛利率对比表.xlsx",
+                filetypes=[("Excel files", "*.xlsx")]
+            )
+            if file_path:
+                wb.save(file_path)
+                messagebox.showinfo("导出成功", f"毛利率对比表已成功导出到 {file_path}")
+        except Exception as e:
+            messagebox.showerror("导出失败", f"导出毛利率对比表时出错：{e}")
+
     def delete_item(self, event):
         """删除报价单中选中的行"""
         selected_item = self.quotation_tree.selection() # 获取报价单表格中选中的行
         if selected_item: # 如果有选中行
-            self.quotation_tree.delete(selected_item) # 删除选中行
+            self.delete_quotation_items(selected_item) # 删除选中行，分组连同其下所有行
             self.calculate_total()  # 重新计算总价
 
     def clear_quotation(self):
         """清空报价单表格"""
         for item in self.quotation_tree.get_children(): # 遍历报价单表格的所有行
             self.quotation_tree.delete(item) # 删除每一行
+        self.journal_record({"op": "clear"}) # 记录到自动保存日志
         self.calculate_total()  # 重置总价
 
     def delete_history_item(self, event):
@@ -732,16 +2020,17 @@ class QuotationApp:
         item = self.history_tree.identify_row(event.y) # 识别点击行
 
         # 只处理操作列（第4列）
-        if column == "#4": # 操作列索引为 #4
-            # 获取选中行的时间戳
-            time_str = self.history_tree.item(item, "values")[0] # 获取选中行的第一列值，即时间戳
+        if column == "#4" and item: # 操作列索引为 #4
+            # 行ID即记录ID，按记录ID找到该记录在文件中的位置
+            record_id = int(item)
+            position = self.history_ids.index(record_id)
 
             # 从文件中删除对应的历史记录
             with open(self.history_file, "r", encoding="utf-8") as file: # 以只读模式打开历史记录文件
                 history = json.load(file) # 从JSON文件加载数据
 
-            # 找到并删除对应的记录
-            history = [entry for entry in history if entry["时间"] != time_str] # 过滤掉要删除的记录
+            # 删除对应的记录（同一秒保存的其他记录不受影响）
+            del history[position]
 
             # 保存更新后的历史记录到文件
             with open(self.history_file, "w", encoding="utf-8") as file: # 以写入模式打开历史记录文件
@@ -749,6 +2038,7 @@ class QuotationApp:
 
             # 从界面中删除该行
             self.history_tree.delete(item) # 从历史记录表格中删除选中行
+            self.unindex_history_entry(record_id) # 同步撤销检索索引
 
     def delete_history(self):
         """删除所有历史记录，并同步更新历史记录文件"""
@@ -760,35 +2050,49 @@ class QuotationApp:
         for item in self.history_tree.get_children(): # 遍历历史记录表格的所有行
             self.history_tree.delete(item)
 
+        # 清空检索索引
+        self.history_index.clear()
+        self.history_tokens.clear()
+        self.history_meta.clear()
+        self.history_vocab.clear()
+        self.history_ids.clear()
+
     def load_history_quotation(self, event):
         """双击历史记录加载报价单数据"""
         selected_item = self.history_tree.selection() # 获取选中的历史记录行
         if not selected_item: # 如果没有选中任何记录，则返回
             return
 
-        history_values = self.history_tree.item(selected_item, "values") # 获取选中历史记录行的数据
-        time_str = history_values[0] # 获取时间戳，用于查找对应的报价单详情
+        position = self.history_ids.index(int(selected_item[0])) # 行ID即记录ID，对应该记录在文件中的位置
 
-        # 从历史记录文件中查找对应的报价单详情
+        # 从历史记录文件中读取对应的报价单详情
         with open(self.history_file, "r", encoding="utf-8") as file: # 以只读模式打开历史记录文件
             history_data = json.load(file) # 加载历史记录数据
 
-        quotation_detail = None # 初始化报价单详情为 None
-        for entry in history_data: # 遍历历史记录条目
-            if entry["时间"] == time_str: # 找到匹配时间戳的记录
-                quotation_detail = entry["报价单详情"] # 获取报价单详情
-                profit_margin_str = entry.get("毛利率", "0.0%") # 获取毛利率，如果不存在则默认为 "0.0%"
-                profit_margin = float(profit_margin_str.replace("%", "")) # 移除百分号并转换为浮点数
-                break # 找到后跳出循环
+        entry = history_data[position] # 选中的历史记录条目
+        quotation_detail = entry["报价单详情"] # 获取报价单详情
+        quotation_groups = entry.get("分组结构", []) # 获取分组结构，旧记录没有分组
+        profit_margin_str = entry.get("毛利率", "0.0%") # 获取毛利率，如果不存在则默认为 "0.0%"
+        profit_margin = float(profit_margin_str.replace("%", "")) # 移除百分号并转换为浮点数
 
         if quotation_detail: # 如果找到了报价单详情
             # 清空当前报价单表格
             for item in self.quotation_tree.get_children(): # 遍历并删除报价单表格所有行
                 self.quotation_tree.delete(item)
 
-            # 将历史报价单数据填充到报价单表格
-            for item_data in quotation_detail: # 遍历报价单详情数据
-                self.quotation_tree.insert("", "end", values=( # 插入新行
+            # 将历史报价单数据填充到报价单表格，按分组编号重建分组
+            groups = {0: ""} # 分组编号 -> 分组行ID
+            groups_at = {} # 位置 -> 排在该明细行之前的分组
+            for group in quotation_groups:
+                groups_at.setdefault(group["位置"], []).append(group)
+
+            def insert_groups(position):
+                for group in groups_at.get(position, []):
+                    groups[group["编号"]] = self.insert_quotation_group(groups.get(group["上级"], ""), group["名称"])
+
+            for position, item_data in enumerate(quotation_detail): # 遍历报价单详情数据
+                insert_groups(position)
+                self.quotation_tree.insert(groups.get(item_data.get("分组编号", 0), ""), "end", values=( # 插入新行
                     item_data["物料编码"],
                     item_data["物料名称"],
                     item_data["规格型号"],
@@ -797,10 +2101,16 @@ class QuotationApp:
                     item_data["小计"],
                     "删除"  # 操作列
                 ))
+            insert_groups(len(quotation_detail)) # 排在最后的分组（含空分组）
+            self.recompute_group_subtotals() # 计算各分组小计
+
             # 将毛利率数据填充到毛利率输入框
             self.profit_margin_entry.delete(0, tk.END) # 清空毛利率输入框
             self.profit_margin_entry.insert(0, f"{profit_margin:.2f}") # 填充毛利率
 
+            # 整张报价单被替换，直接写入自动保存快照
+            self.journal_checkpoint()
+
             # 重新计算总价
             self.calculate_total() # 重新计算总价
 